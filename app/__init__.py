@@ -6,9 +6,13 @@ from flask_login import LoginManager
 from flask_migrate import Migrate
 import os
 
-db = SQLAlchemy()
+from . import sharding
+from .ratelimit import RateLimiter
+
+db = SQLAlchemy(session_options={"class_": sharding.ShardedSession})
 migrate = Migrate()
 login_manager = LoginManager()
+limiter = RateLimiter()
 
 
 def create_app(test_config=None):
@@ -22,6 +26,24 @@ def create_app(test_config=None):
             "sqlite:///../instance/senti.db"
         ),
         SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        # Wallet/ledger shards; 0 keeps everything in the main database
+        SHARD_COUNT=int(os.environ.get("SENTI_SHARDS", 0)),
+        SHARD_RETIRED=int(os.environ.get("SENTI_SHARDS_RETIRED", 0)),
+        SHARD_DATABASE_URI=os.environ.get(
+            "SENTI_SHARD_URI",
+            "sqlite:///../instance/senti_shard_{}.db"
+        ),
+        # Voucher lookup limits (app/ratelimit.py)
+        RATELIMIT_ENABLED=os.environ.get("SENTI_RATELIMIT_ENABLED", "1") != "0",
+        RATELIMIT_USER_BURST=int(os.environ.get("SENTI_RATELIMIT_USER_BURST", 10)),
+        RATELIMIT_USER_PER_MINUTE=float(os.environ.get("SENTI_RATELIMIT_USER_PER_MINUTE", 10)),
+        RATELIMIT_IP_BURST=int(os.environ.get("SENTI_RATELIMIT_IP_BURST", 30)),
+        RATELIMIT_IP_PER_MINUTE=float(os.environ.get("SENTI_RATELIMIT_IP_PER_MINUTE", 30)),
+        # Heroku (which sets DYNO) puts one router in front of the app; without
+        # it every client would share the router's IP bucket
+        RATELIMIT_PROXY_COUNT=int(os.environ.get(
+            "SENTI_RATELIMIT_PROXY_COUNT", 1 if "DYNO" in os.environ else 0
+        )),
     )
 
     if test_config:
@@ -34,15 +56,22 @@ def create_app(test_config=None):
         pass
 
     # Initialize extensions
+    sharding.init_app(app)
     db.init_app(app)
+    sharding.init_engines(app)
     migrate.init_app(app, db)
 
     login_manager.init_app(app)
     login_manager.login_view = "main.login"
     login_manager.login_message_category = "info"
 
+    limiter.init_app(app)
+
     # Import models and routes
     from . import routes, models
     app.register_blueprint(routes.bp)
 
+    from .seed import seed_command
+    app.cli.add_command(seed_command)
+
     return app
\ No newline at end of file
@@ -47,6 +47,8 @@ class User(UserMixin, db.Model):
 # ---------------------------------------------------------
 class Wallet(db.Model):
     __tablename__ = "wallets"
+    # AUTOINCREMENT so each shard's ids start in its own range (see sharding.py)
+    __table_args__ = {"sqlite_autoincrement": True}
 
     id = db.Column(db.Integer, primary_key=True)
     balance = db.Column(db.Float, default=0.0)
@@ -76,7 +78,7 @@ class Voucher(db.Model):
 
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
-    merchant_id = db.Column(db.Integer, db.ForeignKey("users.id"))
+    merchant_id = db.Column(db.Integer, db.ForeignKey("users.id"), index=True)
     redeemer_id = db.Column(db.Integer, db.ForeignKey("users.id"))
 
 
@@ -85,14 +87,15 @@ class Voucher(db.Model):
 # ---------------------------------------------------------
 class Transaction(db.Model):
     __tablename__ = "transactions"
+    __table_args__ = {"sqlite_autoincrement": True}
 
     id = db.Column(db.Integer, primary_key=True)
     type = db.Column(db.String(50))     # deposit, redemption, withdrawal
     amount = db.Column(db.Float)
     description = db.Column(db.String(255))
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
 
-    wallet_id = db.Column(db.Integer, db.ForeignKey("wallets.id"))
+    wallet_id = db.Column(db.Integer, db.ForeignKey("wallets.id"), index=True)
 
 
 # ---------------------------------------------------------
@@ -100,9 +103,10 @@ class Transaction(db.Model):
 # ---------------------------------------------------------
 class WithdrawalRequest(db.Model):
     __tablename__ = "withdrawal_requests"
+    __table_args__ = {"sqlite_autoincrement": True}
 
     id = db.Column(db.Integer, primary_key=True)
-    wallet_id = db.Column(db.Integer, db.ForeignKey("wallets.id"))
+    wallet_id = db.Column(db.Integer, db.ForeignKey("wallets.id"), index=True)
     amount = db.Column(db.Float, nullable=False)
     status = db.Column(db.String(20), default="pending")  # pending | approved | rejected
     account_number = db.Column(db.String(50))
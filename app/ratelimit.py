@@ -0,0 +1,195 @@
+# app/ratelimit.py
+#
+# Token-bucket rate limiting shared by every gunicorn worker on the host.
+# Buckets live in their own small SQLite file (not senti.db) so limiter
+# writes never contend with the app's writer lock, and no Redis is needed.
+
+import os
+import random
+import sqlite3
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, request, session
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL,
+    allowed INTEGER NOT NULL DEFAULT 0,
+    limited INTEGER NOT NULL DEFAULT 0
+)
+"""
+
+# Buckets idle this long are dropped (1 in PRUNE_EVERY requests checks)
+PRUNE_AFTER = 24 * 3600
+PRUNE_EVERY = 1000
+
+
+class RateLimiter:
+    """Per-user and per-IP token buckets stored in a shared SQLite file."""
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._conn_ = None
+        self._opened = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("RATELIMIT_ENABLED", True)
+        app.config.setdefault(
+            "RATELIMIT_DATABASE", os.path.join(app.instance_path, "ratelimit.db")
+        )
+        # Burst size and sustained refill rate for each kind of key
+        app.config.setdefault("RATELIMIT_USER_BURST", 10)
+        app.config.setdefault("RATELIMIT_USER_PER_MINUTE", 10)
+        app.config.setdefault("RATELIMIT_IP_BURST", 30)
+        app.config.setdefault("RATELIMIT_IP_PER_MINUTE", 30)
+        # Reverse proxies in front of the app that append to X-Forwarded-For
+        # (1 on Heroku); 0 keys IP buckets on the socket address. create_app()
+        # reads all of these from SENTI_RATELIMIT_* environment variables.
+        app.config.setdefault("RATELIMIT_PROXY_COUNT", 0)
+
+        for kind in ("USER", "IP"):
+            burst = app.config[f"RATELIMIT_{kind}_BURST"]
+            per_minute = app.config[f"RATELIMIT_{kind}_PER_MINUTE"]
+            if burst < 1 or per_minute <= 0:
+                raise ValueError(
+                    f"RATELIMIT_{kind}_BURST must be >= 1 and "
+                    f"RATELIMIT_{kind}_PER_MINUTE > 0 (set RATELIMIT_ENABLED "
+                    f"to False to turn limiting off)."
+                )
+
+        app.extensions["senti_ratelimit"] = self
+
+    # ---------------------------
+    # STORAGE
+    # ---------------------------
+    def _conn(self):
+        # One connection per process (callers hold self._lock), reopened
+        # after gunicorn forks a worker
+        opened = (current_app.config["RATELIMIT_DATABASE"], os.getpid())
+        if self._conn_ is None or self._opened != opened:
+            conn = sqlite3.connect(opened[0], timeout=5, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = OFF")
+            conn.execute(SCHEMA)
+            self._conn_, self._opened = conn, opened
+        return self._conn_
+
+    def hit(self, limits, now=None):
+        """Take one token from every bucket in `limits`.
+
+        `limits` is a list of (key, burst, per_minute). Tokens are only spent
+        if every bucket has one, so a limited user does not also drain their
+        IP's bucket. Returns 0 when allowed, otherwise the seconds until the
+        emptiest bucket refills.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            return self._hit(self._conn(), limits, now)
+
+    def _hit(self, conn, limits, now):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            state = []
+            retry_after = 0.0
+            for key, burst, per_minute in limits:
+                rate = per_minute / 60.0
+                row = conn.execute(
+                    "SELECT tokens, updated FROM buckets WHERE key = ?", (key,)
+                ).fetchone()
+                tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+                empty = tokens < 1
+                if empty:
+                    retry_after = max(retry_after, (1 - tokens) / rate)
+                state.append((key, tokens, empty))
+
+            # Only the buckets that actually ran out count the rejection
+            allowed = retry_after == 0
+            for key, tokens, empty in state:
+                conn.execute(
+                    "INSERT INTO buckets (key, tokens, updated, allowed, limited) "
+                    "VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, "
+                    "updated = excluded.updated, "
+                    "allowed = allowed + excluded.allowed, "
+                    "limited = limited + excluded.limited",
+                    (key, tokens - 1 if allowed else tokens, now, int(allowed), int(empty)),
+                )
+
+            if random.randrange(PRUNE_EVERY) == 0:
+                conn.execute("DELETE FROM buckets WHERE updated < ?", (now - PRUNE_AFTER,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        return retry_after
+
+    def top_keys(self, limit=10):
+        """Buckets with the most rejected requests, for the admin dashboard."""
+        with self._lock:
+            rows = self._conn().execute(
+                "SELECT key, allowed, limited, tokens, updated FROM buckets "
+                "ORDER BY limited DESC, allowed DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [
+            {"key": k, "allowed": a, "limited": l, "tokens": t, "updated": u}
+            for k, a, l, t, u in rows
+        ]
+
+    # ---------------------------
+    # VIEW DECORATOR
+    # ---------------------------
+    @staticmethod
+    def client_ip():
+        proxies = current_app.config["RATELIMIT_PROXY_COUNT"]
+        route = request.access_route
+        if proxies and request.headers.get("X-Forwarded-For") and len(route) >= proxies:
+            return route[-proxies]
+        return request.remote_addr
+
+    def limit(self, scope, methods=("GET", "POST")):
+        """Reject requests over the per-user or per-IP limit with a 429.
+
+        Place it above `login_required` so it runs before any ORM work: the
+        user id comes straight from the session cookie, not the database.
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapped(*args, **kwargs):
+                config = current_app.config
+                if not config["RATELIMIT_ENABLED"] or request.method not in methods:
+                    return view(*args, **kwargs)
+
+                limits = [(
+                    f"{scope}:ip:{self.client_ip()}",
+                    config["RATELIMIT_IP_BURST"],
+                    config["RATELIMIT_IP_PER_MINUTE"],
+                )]
+                user_id = session.get("_user_id")
+                if user_id:
+                    limits.append((
+                        f"{scope}:user:{user_id}",
+                        config["RATELIMIT_USER_BURST"],
+                        config["RATELIMIT_USER_PER_MINUTE"],
+                    ))
+
+                retry_after = self.hit(limits)
+                if retry_after:
+                    seconds = int(retry_after) + 1
+                    return (
+                        f"Too many requests. Try again in {seconds} seconds.",
+                        429,
+                        {"Retry-After": str(seconds), "Content-Type": "text/plain"},
+                    )
+                return view(*args, **kwargs)
+            return wrapped
+        return decorator
@@ -8,8 +8,11 @@ from flask import (
     flash, request, send_file, abort
 )
 from flask_login import login_user, logout_user, login_required, current_user
+from sqlalchemy.exc import SQLAlchemyError
 
-from . import db
+from . import db, limiter
+from .sharding import gather
+from .serving import run_in_threadpool
 from .models import User, Wallet, Voucher, Transaction, WithdrawalRequest
 from .forms import RegisterForm, LoginForm, VoucherForm, CreateVoucherForm
 
@@ -47,6 +50,66 @@ def log_transaction(wallet_id, trans_type, amount, description):
     db.session.commit()
 
 
+def redeem_for(user, voucher, description):
+    """Credit `voucher` to `user`'s wallet, at most once.
+
+    The voucher (senti.db) and the wallet (possibly a shard) can live in
+    different databases, so the two commits are ordered explicitly: first
+    claim the voucher with a conditional UPDATE, and only if this request won
+    the claim, credit the wallet and write the ledger row. If the credit
+    fails, the claim is released again so the voucher is not lost.
+
+    Returns False if someone else already redeemed it.
+    """
+    claimed = db.session.execute(
+        db.update(Voucher)
+        .where(Voucher.code == voucher.code, Voucher.is_redeemed.is_(False))
+        .values(is_redeemed=True, redeemer_id=user.id)
+    ).rowcount
+    db.session.commit()
+    if claimed != 1:
+        return False
+
+    try:
+        wallet = user.wallet
+        wallet.balance = Wallet.balance + voucher.amount
+        db.session.add(Transaction(
+            wallet_id=wallet.id,
+            type="credit",
+            amount=voucher.amount,
+            description=description
+        ))
+        db.session.commit()
+    except SQLAlchemyError:
+        db.session.rollback()
+        db.session.execute(
+            db.update(Voucher)
+            .where(Voucher.code == voucher.code, Voucher.redeemer_id == user.id)
+            .values(is_redeemed=False, redeemer_id=None)
+        )
+        db.session.commit()
+        raise
+    return True
+
+
+def render_qr_png(data):
+    """Render `data` as a QR code and return the PNG bytes."""
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_M,
+        box_size=7,
+        border=2,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+
+    img = qr.make_image(fill_color="black", back_color="white")
+
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
 # ---------------------------
 # HOME
 # ---------------------------
@@ -139,6 +202,7 @@ def dashboard():
 # WALLET PAGE & MANUAL REDEEM
 # ---------------------------
 @bp.route("/wallet", methods=["GET", "POST"])
+@limiter.limit("voucher", methods=("POST",))
 @login_required
 def wallet():
     ensure_wallet_for(current_user)
@@ -148,19 +212,15 @@ def wallet():
         code = form.code.data.strip().upper()
         v = Voucher.query.filter_by(code=code).first()
 
-        if not v:
-            flash("Voucher not found.", "danger")
-        elif v.is_redeemed:
-            flash("Voucher already redeemed.", "warning")
-        else:
-            # credit amount
-            current_user.wallet.balance += v.amount
-            v.is_redeemed = True
-            v.redeemer_id = current_user.id
-            db.session.commit()
-
-            log_transaction(current_user.wallet.id, "credit", v.amount, f"Voucher redeemed: {v.code}")
-            flash(f"R{v.amount:.2f} added to your wallet.", "success")
+        try:
+            if not v:
+                flash("Voucher not found.", "danger")
+            elif v.is_redeemed or not redeem_for(current_user, v, f"Voucher redeemed: {v.code}"):
+                flash("Voucher already redeemed.", "warning")
+            else:
+                flash(f"R{v.amount:.2f} added to your wallet.", "success")
+        except SQLAlchemyError:
+            flash("Could not redeem the voucher right now. Please try again.", "danger")
 
         return redirect(url_for("main.wallet"))
 
@@ -275,6 +335,7 @@ def profile():
 # QR AUTO REDEEM
 # ---------------------------
 @bp.route("/redeem/<code>")
+@limiter.limit("voucher")
 @login_required
 def redeem_voucher(code):
     v = Voucher.query.filter_by(code=code).first()
@@ -289,12 +350,13 @@ def redeem_voucher(code):
 
     ensure_wallet_for(current_user)
 
-    current_user.wallet.balance += v.amount
-    v.is_redeemed = True
-    v.redeemer_id = current_user.id
-    db.session.commit()
-
-    log_transaction(current_user.wallet.id, "credit", v.amount, f"Voucher redeemed via QR: {v.code}")
+    try:
+        if not redeem_for(current_user, v, f"Voucher redeemed via QR: {v.code}"):
+            flash("Voucher already redeemed.", "warning")
+            return redirect(url_for("main.wallet"))
+    except SQLAlchemyError:
+        flash("Could not redeem the voucher right now. Please try again.", "danger")
+        return redirect(url_for("main.wallet"))
 
     flash(f"Voucher redeemed: R{v.amount:.2f} credited.", "success")
     return redirect(url_for("main.wallet"))
@@ -308,22 +370,10 @@ def voucher_qr(code):
     v = Voucher.query.filter_by(code=code).first_or_404()
     redeem_url = url_for("main.redeem_voucher", code=v.code, _external=True)
 
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_M,
-        box_size=7,
-        border=2,
-    )
-    qr.add_data(redeem_url)
-    qr.make(fit=True)
-
-    img = qr.make_image(fill_color="black", back_color="white")
-
-    buf = io.BytesIO()
-    img.save(buf, format="PNG")
-    buf.seek(0)
+    # CPU-bound; off the event loop when serving in async mode
+    png = run_in_threadpool(render_qr_png, redeem_url)
 
-    return send_file(buf, mimetype="image/png")
+    return send_file(io.BytesIO(png), mimetype="image/png")
 
 
 # ---------------------------
@@ -419,8 +469,13 @@ def admin_dashboard():
     total_vouchers = Voucher.query.count()
     redeemed_vouchers = Voucher.query.filter_by(is_redeemed=True).count()
     unredeemed_vouchers = total_vouchers - redeemed_vouchers
-    total_balance = db.session.query(db.func.sum(Wallet.balance)).scalar() or 0
-    recent = Transaction.query.order_by(Transaction.timestamp.desc()).limit(10).all()
+    # Wallets and transactions may be sharded: query every shard and merge
+    total_balance = sum(b or 0 for b in gather(db.select(db.func.sum(Wallet.balance)), scalars=True))
+    recent = sorted(
+        gather(db.select(Transaction).order_by(Transaction.timestamp.desc()).limit(10), scalars=True),
+        key=lambda t: t.timestamp, reverse=True,
+    )[:10]
+    rate_limits = limiter.top_keys()
 
     return render_template("admin_dashboard.html",
                            total_users=total_users,
@@ -429,7 +484,8 @@ def admin_dashboard():
                            redeemed_vouchers=redeemed_vouchers,
                            unredeemed_vouchers=unredeemed_vouchers,
                            total_balance=total_balance,
-                           recent=recent)
+                           recent=recent,
+                           rate_limits=rate_limits)
 
 
 # ---------------------------------------------
@@ -442,8 +498,8 @@ def admin_withdrawals():
         flash("Admin access required.", "danger")
         return redirect(url_for("main.dashboard"))
 
-    pending = WithdrawalRequest.query.filter_by(status="pending").all()
-    approved = WithdrawalRequest.query.filter_by(status="approved").all()
+    pending = gather(db.select(WithdrawalRequest).filter_by(status="pending"), scalars=True)
+    approved = gather(db.select(WithdrawalRequest).filter_by(status="approved"), scalars=True)
 
     return render_template("admin_withdrawals.html", pending=pending, approved=approved)
 
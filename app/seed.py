@@ -0,0 +1,457 @@
+# app/seed.py
+
+import random
+import time
+from contextlib import ExitStack
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from werkzeug.security import generate_password_hash
+
+from . import db
+from .models import User, Wallet, Voucher, Transaction, WithdrawalRequest
+from .sharding import (
+    SHARD_ID_BITS, SHARDED_TABLES, bind_key, init_shards, jump_hash, shard_count,
+    shard_id_base
+)
+
+
+ADMIN_EMAIL = "admin@senti.com"
+ADMIN_PASSWORD = "adminpass123"
+SEED_PASSWORD = "seedpass123"
+
+# Voucher face values and how often merchants print them
+VOUCHER_AMOUNTS = [10.0, 20.0, 50.0, 100.0, 200.0, 500.0]
+VOUCHER_WEIGHTS = [30, 25, 20, 15, 7, 3]
+
+WITHDRAWAL_STATUSES = ["approved", "pending", "rejected"]
+WITHDRAWAL_WEIGHTS = [70, 20, 10]
+
+BANKS = ["FNB", "ABSA", "Standard Bank", "Nedbank", "Capitec", "TymeBank"]
+
+CODE_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+CODE_LENGTH = 10
+CODE_SPACE = len(CODE_ALPHABET) ** CODE_LENGTH
+# ~CODE_SPACE / golden ratio, odd and not a multiple of 3, so id -> code is a
+# bijection over CODE_SPACE that scatters consecutive ids across the space
+CODE_MULTIPLIER = 2259630184031291
+
+HISTORY_DAYS = 365
+
+
+# ---------------------------
+# ROW GENERATORS
+# ---------------------------
+# Every generator is a top-level function of (start_id, count, ctx, seed) so
+# chunks can be produced independently in worker processes.
+
+def voucher_code(voucher_id):
+    """Map a voucher id to a unique, random-looking 10 character code."""
+    n = (voucher_id * CODE_MULTIPLIER) % CODE_SPACE
+    chars = []
+    for _ in range(CODE_LENGTH):
+        n, r = divmod(n, len(CODE_ALPHABET))
+        chars.append(CODE_ALPHABET[r])
+    return "".join(chars)
+
+
+def skewed_pick(rng, first, count, power=3):
+    """Pick an id in [first, first + count) favouring the low end.
+
+    A handful of early, active accounts end up owning most of the activity,
+    which is closer to real wallets than a uniform spread.
+    """
+    return first + int(count * (rng.random() ** power))
+
+
+def random_timestamp(rng, now):
+    return now - timedelta(seconds=rng.randrange(HISTORY_DAYS * 86400))
+
+
+def gen_users(start_id, count, ctx, seed):
+    rng = random.Random(seed)
+    first_merchant, merchants = ctx["first_merchant"], ctx["merchants"]
+    rows = []
+    for uid in range(start_id, start_id + count):
+        is_merchant = uid < first_merchant + merchants
+        rows.append({
+            "id": uid,
+            "email": f"{'merchant' if is_merchant else 'user'}{uid}@seed.senti",
+            "password_hash": ctx["password_hash"],
+            "name": f"Seed {'Merchant' if is_merchant else 'User'} {uid}",
+            "phone": "0" + "".join(rng.choices("0123456789", k=9)),
+            "role": "merchant" if is_merchant else "consumer",
+        })
+    return rows
+
+
+def activity_share(total, index, count, rng, power=3):
+    """How many of `total` events wallet `index` of `count` gets.
+
+    Shares follow the same skew as skewed_pick(), so the early accounts do
+    most of the activity, and fractional shares are rounded at random so the
+    totals come out right on average.
+    """
+    lo = (index / count) ** (1 / power)
+    hi = ((index + 1) / count) ** (1 / power)
+    expected = total * (hi - lo)
+    n = int(expected)
+    return n + (rng.random() < expected - n)
+
+
+def gen_wallets(start_id, count, ctx, seed):
+    """Wallets with their deposit and withdrawal history.
+
+    Each wallet replays a timeline of deposits and withdrawal requests.
+    Withdrawals never exceed the funds not already reserved by pending
+    requests, approved ones are debited, and the stored balance is what the
+    ledger adds up to (redemption credits are added by the voucher step).
+    """
+    rng = random.Random(seed)
+    now = ctx["now"]
+    offset = ctx["first_user"] - ctx["first_wallet"]
+    wallets, ledger, requests = [], [], []
+    for wid in range(start_id, start_id + count):
+        index = wid - ctx["first_wallet"]
+        events = (["deposit"] * activity_share(ctx["deposits"], index, ctx["wallets"], rng)
+                  + ["withdrawal"] * activity_share(ctx["withdrawals"], index, ctx["wallets"], rng))
+        rng.shuffle(events)
+        stamps = sorted(random_timestamp(rng, now) for _ in events)
+
+        balance = reserved = 0.0
+        for event, stamp in zip(events, stamps):
+            if event == "deposit":
+                # Log-normal deposits: mostly small top-ups, the odd large one
+                amount = round(min(rng.lognormvariate(4.5, 0.9), 5000.0), 2)
+                balance = round(balance + amount, 2)
+                ledger.append({
+                    "type": "credit", "amount": amount,
+                    "description": f"Deposit simulation of R{amount:.2f}",
+                    "timestamp": stamp, "wallet_id": wid,
+                })
+                continue
+
+            available = balance - reserved
+            if available < 10:
+                continue
+            amount = round(rng.uniform(0.1, 0.9) * available, 2)
+            status = rng.choices(WITHDRAWAL_STATUSES, WITHDRAWAL_WEIGHTS)[0]
+            if status == "approved":
+                balance = round(balance - amount, 2)
+                ledger.append({
+                    "type": "debit", "amount": amount,
+                    "description": f"Withdrawal approved (R{amount:.2f})",
+                    "timestamp": stamp, "wallet_id": wid,
+                })
+            elif status == "pending":
+                reserved += amount
+            requests.append({
+                "wallet_id": wid,
+                "amount": amount,
+                "status": status,
+                "account_number": "".join(rng.choices("0123456789", k=11)),
+                "bank_name": rng.choice(BANKS),
+                "timestamp": stamp,
+            })
+
+        wallets.append({"id": wid, "balance": balance, "user_id": wid + offset})
+    return {"wallets": wallets, "transactions": ledger, "withdrawal_requests": requests}
+
+
+def gen_vouchers(start_id, count, ctx, seed):
+    """Vouchers, plus the wallet credit for every redeemed one."""
+    rng = random.Random(seed)
+    now = ctx["now"]
+    offset = ctx["first_user"] - ctx["first_wallet"]
+    vouchers, credits = [], []
+    for vid in range(start_id, start_id + count):
+        code = voucher_code(vid)
+        amount = rng.choices(VOUCHER_AMOUNTS, VOUCHER_WEIGHTS)[0]
+        created_at = random_timestamp(rng, now)
+        redeemer_id = None
+        if ctx["consumers"] and rng.random() < ctx["redeemed_fraction"]:
+            redeemer_id = skewed_pick(rng, ctx["first_consumer"], ctx["consumers"])
+            credits.append({
+                "type": "credit", "amount": amount,
+                "description": f"Voucher redeemed: {code}",
+                "timestamp": min(now, created_at + timedelta(seconds=rng.randrange(30 * 86400))),
+                "wallet_id": redeemer_id - offset,
+            })
+        vouchers.append({
+            "id": vid,
+            "code": code,
+            "amount": amount,
+            "is_redeemed": redeemer_id is not None,
+            "created_at": created_at,
+            "merchant_id": skewed_pick(rng, ctx["first_merchant"], ctx["merchants"]),
+            "redeemer_id": redeemer_id,
+        })
+    return {"vouchers": vouchers, "transactions": credits}
+
+
+def shard_rows(table_name, rows, ctx):
+    """Split generated rows by destination shard ({None: rows} if unsharded).
+
+    Sharded ids get their shard in the high bits, as the app allocates them;
+    rows without an explicit id get one from the shard's own sequence.
+    """
+    n = ctx["shards"]
+    if not n or table_name not in SHARDED_TABLES:
+        return {None: rows}
+
+    offset = ctx.get("first_user", 0) - ctx.get("first_wallet", 0)
+    out = {}
+    for row in rows:
+        if table_name == "wallets":
+            shard = jump_hash(row["user_id"], n)
+        else:
+            shard = jump_hash(row["wallet_id"] + offset, n)
+            row["wallet_id"] |= shard_id_base(shard)
+        if "id" in row:
+            row["id"] |= shard_id_base(shard)
+        out.setdefault(shard, []).append(row)
+    return out
+
+
+def _run_task(task):
+    func, start_id, count, ctx, seed = task
+    if func is gen_users:
+        return {"users": {None: func(start_id, count, ctx, seed)}}
+    return {
+        name: shard_rows(name, rows, ctx)
+        for name, rows in func(start_id, count, ctx, seed).items()
+    }
+
+
+# ---------------------------
+# BULK LOADER
+# ---------------------------
+def _targets(table):
+    """Bind keys (None = default, else shard number) a table is stored on."""
+    n = shard_count()
+    return list(range(n)) if n and table.name in SHARDED_TABLES else [None]
+
+
+def _next_id(conns, table):
+    # Local part only: sharded ids carry the shard above SHARD_ID_BITS
+    mask = (1 << SHARD_ID_BITS) - 1
+    return max(
+        (conns[t].execute(db.select(db.func.max(table.c.id))).scalar() or 0) & mask
+        for t in _targets(table)
+    ) + 1
+
+
+def _load(conns, func, first_id, total, ctx, batch_size, pool, seed, on_rows=None):
+    """Generate rows for ids [first_id, first_id + total) in batches and bulk
+    insert them. Returns a dict of table name -> rows inserted."""
+    counts = {}
+    if total <= 0:
+        return counts
+
+    tables = db.metadata.tables
+    tasks = [
+        (func, start, min(batch_size, first_id + total - start), ctx, seed ^ start)
+        for start in range(first_id, first_id + total, batch_size)
+    ]
+    chunks = pool.imap(_run_task, tasks) if pool else map(_run_task, tasks)
+
+    for by_table in chunks:
+        for name, by_shard in by_table.items():
+            for target, rows in by_shard.items():
+                if rows:
+                    conns[target].execute(tables[name].insert(), rows)
+                    counts[name] = counts.get(name, 0) + len(rows)
+                    if on_rows:
+                        on_rows(name, target, rows)
+    return counts
+
+
+def seed_database(users=0, merchants=0, vouchers=0, redeemed_fraction=0.3,
+                  transactions=0, withdrawals=0, batch_size=50000, workers=1,
+                  reset=False, seed=None, echo=print):
+    """Fill the database with synthetic users, wallets, vouchers and ledger rows.
+
+    The data is self-consistent: every redeemed voucher has its credit row on
+    the redeemer's wallet, every approved withdrawal its debit row, pending
+    withdrawals are covered by the balance, and balances equal the ledger.
+    `transactions` and `withdrawals` are the expected number of deposits and
+    withdrawal requests; redemption credits and debits come on top.
+
+    Rows are generated in batches (optionally across `workers` processes) and
+    written with Core executemany inserts inside a single transaction per
+    database; wallet and ledger rows go to their shard when sharding is on.
+    Secondary indexes on empty tables are dropped before loading and rebuilt
+    afterwards.
+    Returns a dict of table name -> rows inserted.
+    """
+    if merchants <= 0 and vouchers > 0:
+        raise ValueError("Vouchers need at least one merchant.")
+    if users + merchants <= 0 and (transactions > 0 or withdrawals > 0):
+        raise ValueError("Transactions and withdrawals need at least one wallet.")
+
+    seed = random.randrange(2 ** 32) if seed is None else seed
+    engines = {None: db.engine}
+    engines.update({s: db.engines[bind_key(s)] for s in range(shard_count())})
+
+    tables = [t.__table__ for t in (User, Wallet, Voucher, Transaction, WithdrawalRequest)]
+    # Shard tables are handled per shard below; db.drop_all() would also walk
+    # the (empty) shard metadatas Flask-SQLAlchemy keeps for every bind key
+    if reset:
+        db.drop_all(bind_key=None)
+        for target in range(shard_count()):
+            for table in reversed(tables):
+                if table.name in SHARDED_TABLES:
+                    table.drop(engines[target], checkfirst=True)
+    db.create_all(bind_key=None)
+    init_shards()
+
+    # Only tables that start out empty get their indexes rebuilt; rebuilding
+    # over existing rows costs more than maintaining them during a top-up.
+    indexes = []
+    for table in tables:
+        for target in _targets(table):
+            with engines[target].connect() as conn:
+                if conn.execute(db.select(table.c.id).limit(1)).first() is None:
+                    indexes.extend((engines[target], ix) for ix in table.indexes)
+    for engine, ix in indexes:
+        ix.drop(engine, checkfirst=True)
+
+    counts = {}
+    pool = Pool(workers) if workers > 1 else None
+    started = time.perf_counter()
+    try:
+        with ExitStack() as stack:
+            conns = {}
+            for target, engine in engines.items():
+                conn = conns[target] = stack.enter_context(engine.begin())
+                if engine.dialect.name == "sqlite":
+                    conn.exec_driver_sql("PRAGMA synchronous = OFF")
+                    conn.exec_driver_sql("PRAGMA journal_mode = MEMORY")
+                    conn.exec_driver_sql("PRAGMA cache_size = -200000")
+            default = conns[None]
+
+            users_t, wallets_t = User.__table__, Wallet.__table__
+            admin_id = default.execute(
+                db.select(users_t.c.id).where(users_t.c.email == ADMIN_EMAIL)
+            ).scalar()
+            if admin_id is None:
+                admin_id = _next_id(conns, users_t)
+                default.execute(users_t.insert(), [{
+                    "id": admin_id,
+                    "email": ADMIN_EMAIL,
+                    "password_hash": generate_password_hash(ADMIN_PASSWORD),
+                    "role": "admin",
+                }])
+                admin_wallet = [{
+                    "id": _next_id(conns, wallets_t),
+                    "balance": 0.0,
+                    "user_id": admin_id,
+                }]
+                for target, rows in shard_rows("wallets", admin_wallet, {"shards": shard_count()}).items():
+                    conns[target].execute(wallets_t.insert(), rows)
+                echo(f"Admin created with wallet: {ADMIN_EMAIL}")
+
+            first_user = _next_id(conns, users_t)
+            ctx = {
+                "now": datetime.utcnow(),
+                # One hash shared by every seeded account; hashing per row
+                # would dominate the run time.
+                "password_hash": generate_password_hash(SEED_PASSWORD),
+                "redeemed_fraction": redeemed_fraction,
+                "first_user": first_user,
+                "first_merchant": first_user,
+                "merchants": merchants,
+                "first_consumer": first_user + merchants,
+                "consumers": users,
+                "first_wallet": _next_id(conns, wallets_t),
+                "wallets": users + merchants,
+                "deposits": transactions,
+                "withdrawals": withdrawals,
+                "shards": shard_count(),
+            }
+
+            # Redemption credits land after the wallets exist; add them to
+            # the balances in one pass per database at the end.
+            redeemed = {}
+
+            def collect_credits(name, target, rows):
+                if name == "transactions":
+                    totals = redeemed.setdefault(target, {})
+                    for row in rows:
+                        totals[row["wallet_id"]] = totals.get(row["wallet_id"], 0) + row["amount"]
+
+            plan = [
+                (gen_users, first_user, users + merchants, None),
+                (gen_wallets, ctx["first_wallet"], users + merchants, None),
+                (gen_vouchers, _next_id(conns, Voucher.__table__), vouchers, collect_credits),
+            ]
+            for func, first_id, total, on_rows in plan:
+                t0 = time.perf_counter()
+                loaded = _load(conns, func, first_id, total, ctx, batch_size, pool, seed, on_rows)
+                for name, n in loaded.items():
+                    counts[name] = counts.get(name, 0) + n
+                if loaded:
+                    echo(f"{', '.join(f'{k}: {v}' for k, v in loaded.items())} rows "
+                         f"in {time.perf_counter() - t0:.1f}s")
+
+            for target, totals in redeemed.items():
+                conns[target].execute(
+                    wallets_t.update()
+                    .where(wallets_t.c.id == db.bindparam("wid"))
+                    .values(balance=db.func.round(wallets_t.c.balance + db.bindparam("credit"), 2)),
+                    [{"wid": wid, "credit": credit} for wid, credit in totals.items()],
+                )
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+        t0 = time.perf_counter()
+        for engine, ix in indexes:
+            ix.create(engine, checkfirst=True)
+        if indexes:
+            echo(f"Indexes rebuilt in {time.perf_counter() - t0:.1f}s")
+
+    elapsed = time.perf_counter() - started
+    total_rows = sum(counts.values())
+    rate = total_rows / elapsed * 60 if elapsed else 0
+    echo(f"Seeded {total_rows} rows in {elapsed:.1f}s ({rate:,.0f} rows/min, seed={seed}).")
+    return counts
+
+
+# ---------------------------
+# CLI
+# ---------------------------
+@click.command("senti-seed")
+@click.option("--users", default=1000, show_default=True, help="Consumer accounts to create.")
+@click.option("--merchants", default=50, show_default=True, help="Merchant accounts to create.")
+@click.option("--vouchers", default=5000, show_default=True, help="Vouchers spread across merchants.")
+@click.option("--redeemed-fraction", default=0.3, show_default=True,
+              type=click.FloatRange(0.0, 1.0), help="Share of vouchers marked redeemed.")
+@click.option("--transactions", default=20000, show_default=True,
+              help="Deposits to create (redemption credits and withdrawal debits come on top).")
+@click.option("--withdrawals", default=500, show_default=True,
+              help="Withdrawal requests to create (approximate; each is capped at the balance).")
+@click.option("--batch-size", default=50000, show_default=True, type=click.IntRange(1),
+              help="Rows generated and inserted per batch.")
+@click.option("--workers", default=1, show_default=True, type=click.IntRange(1),
+              help="Processes used to generate rows.")
+@click.option("--reset/--no-reset", default=False, help="Drop and recreate all tables first.")
+@click.option("--seed", type=int, default=None, help="Random seed for reproducible data.")
+@with_appcontext
+def seed_command(users, merchants, vouchers, redeemed_fraction, transactions,
+                 withdrawals, batch_size, workers, reset, seed):
+    """Generate synthetic data for performance testing and staging."""
+    click.echo(f"Seeding {current_app.config['SQLALCHEMY_DATABASE_URI']}")
+    try:
+        seed_database(
+            users=users, merchants=merchants, vouchers=vouchers,
+            redeemed_fraction=redeemed_fraction, transactions=transactions,
+            withdrawals=withdrawals, batch_size=batch_size, workers=workers,
+            reset=reset, seed=seed, echo=click.echo,
+        )
+    except ValueError as e:
+        raise click.UsageError(str(e))
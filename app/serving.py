@@ -0,0 +1,35 @@
+# app/serving.py
+#
+# Helpers for the async serving mode. The app is plain WSGI; under
+# `SENTI_WORKER_CLASS=gevent` gunicorn monkey-patches the stdlib so each
+# worker multiplexes many slow clients on one OS thread. Anything that burns
+# CPU inside a request (QR rendering) is handed to gevent's native thread pool
+# so the event loop keeps servicing other connections meanwhile.
+#
+# Database access is NOT cooperative: sqlite3 is a C extension gevent cannot
+# patch, so every ORM query, and every wait on a locked senti.db, shard or
+# ratelimit.db (up to the 5s busy timeout), blocks the whole worker's event
+# loop. The async mode therefore helps with slow clients and QR rendering,
+# not with slow queries; keep queries short and run enough workers.
+
+try:
+    from gevent import get_hub
+    from gevent.monkey import is_module_patched
+except ImportError:  # gevent is only needed for the async mode
+    get_hub = None
+
+
+def gevent_active():
+    """True when running inside a monkey-patched gevent worker."""
+    return get_hub is not None and is_module_patched("socket")
+
+
+def run_in_threadpool(func, *args):
+    """Run a blocking call on a real OS thread when serving under gevent.
+
+    Under the sync worker there is no event loop to protect, so the call is
+    made inline.
+    """
+    if gevent_active():
+        return get_hub().threadpool.apply(func, args)
+    return func(*args)
@@ -0,0 +1,454 @@
+# app/sharding.py
+#
+# Hash-sharded storage for wallets and their ledger.
+#
+# With SENTI_SHARDS=N (N > 0) the wallets, transactions and withdrawal_requests
+# tables live in N extra database binds (shard_0 .. shard_N-1), one SQLite file
+# each, so deposits, redemptions and withdrawals for different users no longer
+# queue on one writer lock. Users and vouchers stay in the default database.
+#
+# A user's rows live on shard jump_hash(user_id, N). Every sharded row id
+# carries its shard in the high bits ((id >> SHARD_ID_BITS) - 1), which lets
+# the router find a row from its id or wallet_id alone. The lowest range is
+# left to the unsharded database, so an id from before sharding never names a
+# shard (it is simply not found) and cannot reach another user's row:
+#
+#   * flushes go to the shard of the instance being written
+#   * queries whose WHERE clause ANDs in a shard key (user_id, id, wallet_id)
+#     `== value` go to that shard
+#   * anything else on a sharded table must use gather() (scatter-gather) or
+#     an explicit `with use_shard(n):` block, otherwise ShardRoutingError
+#
+# A request that touches a shard and the default database (e.g. redeeming a
+# voucher) commits each database in turn, and the commits are not atomic
+# together. Such paths order them explicitly: claim in the default database
+# first (routes.redeem_for), write the shard only if the claim won, and undo
+# the claim if the shard commit fails.
+#
+# N = 0 (the default) disables all of this and keeps everything in senti.db.
+# After changing N run `flask senti-shards rebalance`; when shrinking, set
+# SENTI_SHARDS_RETIRED to the number of old shard files past N to drain.
+
+import contextvars
+from contextlib import contextmanager
+
+import click
+import sqlalchemy as sa
+from flask import current_app
+from flask.cli import with_appcontext
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import BinaryExpression, BooleanClauseList
+from sqlalchemy.sql.selectable import AliasedReturnsRows
+
+
+SHARDED_TABLES = ("wallets", "transactions", "withdrawal_requests")
+
+# Columns the router understands, and whether they hold a user id or a
+# shard-tagged row id.
+SHARD_KEYS = {
+    ("wallets", "user_id"): "user",
+    ("wallets", "id"): "id",
+    ("transactions", "id"): "id",
+    ("transactions", "wallet_id"): "id",
+    ("withdrawal_requests", "id"): "id",
+    ("withdrawal_requests", "wallet_id"): "id",
+}
+
+SHARD_ID_BITS = 40
+
+_current_shard = contextvars.ContextVar("senti_shard", default=None)
+
+
+class ShardRoutingError(RuntimeError):
+    pass
+
+
+# ---------------------------
+# ROUTING
+# ---------------------------
+def jump_hash(key, buckets):
+    """Jump consistent hash (Lamping & Veach).
+
+    Growing from N to N + 1 shards moves only 1/(N + 1) of the users.
+    """
+    b, j = -1, 0
+    key &= 0xFFFFFFFFFFFFFFFF
+    while j < buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((b + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return b
+
+
+def shard_count(app=None):
+    return (app or current_app).config.get("SHARD_COUNT", 0)
+
+
+def bind_key(shard):
+    return f"shard_{shard}"
+
+
+def shard_for_user(user_id):
+    return jump_hash(int(user_id), shard_count())
+
+
+def shard_id_base(shard):
+    """Lowest id `shard` allocates; ids below 1 << SHARD_ID_BITS belong to
+    the unsharded database."""
+    return (shard + 1) << SHARD_ID_BITS
+
+
+def shard_for_id(row_id):
+    """Shard a wallet, transaction or withdrawal id was allocated on (-1 for
+    ids from the unsharded database)."""
+    return (int(row_id) >> SHARD_ID_BITS) - 1
+
+
+def shard_for_instance(instance):
+    table = instance.__table__.name
+    if table == "wallets":
+        if instance.id is not None:
+            return shard_for_id(instance.id)
+        return shard_for_user(instance.user_id)
+    if instance.wallet_id is not None:
+        return shard_for_id(instance.wallet_id)
+    raise ShardRoutingError(f"Cannot route {table} row without a wallet_id.")
+
+
+@contextmanager
+def use_shard(shard):
+    """Route unkeyed statements on sharded tables to `shard`."""
+    token = _current_shard.set(shard)
+    try:
+        yield
+    finally:
+        _current_shard.reset(token)
+
+
+def _is_sharded(mapper=None, clause=None):
+    if mapper is not None:
+        return sa.inspect(mapper).local_table.name in SHARDED_TABLES
+    table = getattr(clause, "table", None)
+    return getattr(table, "name", None) in SHARDED_TABLES
+
+
+def _and_terms(clause):
+    """Flatten the top-level AND of a WHERE clause into its terms."""
+    if isinstance(clause, BooleanClauseList) and clause.operator is operators.and_:
+        for term in clause.clauses:
+            yield from _and_terms(term)
+    elif clause is not None:
+        yield clause
+
+
+def _where_terms(statement):
+    if isinstance(statement, AliasedReturnsRows):
+        yield from _where_terms(statement.element)
+        return
+    yield from _and_terms(getattr(statement, "whereclause", None))
+    # SELECT ... FROM (SELECT ...), as Query.count() builds: the inner
+    # statement's terms bound every row the outer one can see
+    froms = statement.get_final_froms() if isinstance(statement, sa.Select) else []
+    if len(froms) == 1 and isinstance(froms[0], AliasedReturnsRows):
+        yield from _where_terms(froms[0])
+
+
+def _shard_from_criteria(statement, params):
+    """Find the single shard a statement's `key == value` criteria point at.
+
+    Only equality terms ANDed at the top of the WHERE clause count: a key
+    inside an OR (or any other expression) does not confine the rows to one
+    shard, so such statements get no shard and fail to route.
+    """
+    found = set()
+    params = params if isinstance(params, dict) else {}
+
+    for term in _where_terms(statement):
+        if not isinstance(term, BinaryExpression) or term.operator is not operators.eq:
+            continue
+        for col, bind in ((term.left, term.right), (term.right, term.left)):
+            kind = SHARD_KEYS.get((getattr(getattr(col, "table", None), "name", None),
+                                   getattr(col, "name", None)))
+            if kind and isinstance(bind, sa.BindParameter):
+                value = params.get(bind.key, bind.effective_value)
+                if value is not None:
+                    found.add(shard_for_user(value) if kind == "user" else shard_for_id(value))
+
+    return found.pop() if len(found) == 1 else None
+
+
+class ShardedSession(Session):
+    """Flask-SQLAlchemy session that sends sharded rows to their shard bind."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, shard_id=None, **kwargs):
+        if bind is None and shard_count() and _is_sharded(mapper, clause):
+            if shard_id is None:
+                shard_id = _current_shard.get()
+            if shard_id is None:
+                raise ShardRoutingError(
+                    "Statement on a sharded table has no shard key; "
+                    "filter on user_id/id/wallet_id or use sharding.gather()."
+                )
+            if not 0 <= shard_id < shard_count():
+                raise ShardRoutingError(f"Shard {shard_id} is not configured.")
+            return self._db.engines[bind_key(shard_id)]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def connection_callable(self, mapper, instance):
+        # Used by flush() to pick a connection per instance
+        shard_id = None
+        if shard_count() and _is_sharded(mapper):
+            shard_id = shard_for_instance(instance)
+        return self.connection(bind_arguments={"mapper": mapper, "shard_id": shard_id})
+
+
+@event.listens_for(ShardedSession, "do_orm_execute")
+def _route_statement(orm_context):
+    if not shard_count() or "shard_id" in orm_context.bind_arguments:
+        return
+    mapper = orm_context.bind_mapper
+    if mapper is None or not _is_sharded(mapper):
+        return
+    shard_id = _shard_from_criteria(orm_context.statement, orm_context.parameters)
+    if shard_id is None:
+        return
+    if not 0 <= shard_id < shard_count():
+        # An id whose high bits name no configured shard (e.g. a made-up URL)
+        # matches no rows; answer with an empty result instead of an error.
+        return orm_context.invoke_statement(
+            statement=orm_context.statement.where(sa.false()),
+            bind_arguments={"shard_id": 0},
+        )
+    orm_context.bind_arguments["shard_id"] = shard_id
+
+
+# ---------------------------
+# SCATTER-GATHER
+# ---------------------------
+def shard_ids():
+    """Every configured shard, or [None] (the default bind) when unsharded."""
+    n = shard_count()
+    return list(range(n)) if n else [None]
+
+
+def gather(statement, scalars=False):
+    """Run a SELECT on every shard and return the concatenated rows.
+
+    Combining per-shard results (summing, re-sorting, re-limiting) is up to
+    the caller.
+    """
+    session = current_app.extensions["sqlalchemy"].session
+    rows = []
+    for shard_id in shard_ids():
+        result = session.execute(statement, bind_arguments={"shard_id": shard_id})
+        rows.extend(result.scalars() if scalars else result)
+    return rows
+
+
+# ---------------------------
+# SETUP & REBALANCING
+# ---------------------------
+def init_app(app):
+    """Add one SQLALCHEMY_BINDS entry per shard. Call before db.init_app()."""
+    # Retired shards (left over after shrinking) get binds so rebalance can
+    # drain them, but the router never sends new work there.
+    n = shard_count(app) + app.config.get("SHARD_RETIRED", 0)
+    binds = app.config.setdefault("SQLALCHEMY_BINDS", {})
+    for shard in range(n):
+        binds.setdefault(bind_key(shard), app.config["SHARD_DATABASE_URI"].format(shard))
+    app.cli.add_command(shards_command)
+
+
+def _enable_wal(dbapi_conn, connection_record):
+    dbapi_conn.execute("PRAGMA journal_mode = WAL")
+
+
+def init_engines(app):
+    """Put every SQLite shard in WAL mode, so readers (gather(), history
+    pages) do not block a shard's writer. Call after db.init_app()."""
+    n = shard_count(app) + app.config.get("SHARD_RETIRED", 0)
+    with app.app_context():
+        engines = app.extensions["sqlalchemy"].engines
+        for shard in range(n):
+            engine = engines[bind_key(shard)]
+            if engine.dialect.name == "sqlite":
+                event.listen(engine, "connect", _enable_wal)
+
+
+def _sharded_tables():
+    db = current_app.extensions["sqlalchemy"]
+    return [db.metadata.tables[name] for name in SHARDED_TABLES]
+
+
+def _engine(shard_id):
+    engines = current_app.extensions["sqlalchemy"].engines
+    return engines[None if shard_id is None else bind_key(shard_id)]
+
+
+def init_shards(count=None):
+    """Create the sharded tables on every shard and start each shard's ids
+    at shard_id_base(shard)."""
+    count = shard_count() if count is None else count
+    for shard_id in range(count):
+        engine = _engine(shard_id)
+        if engine.dialect.name != "sqlite":
+            raise ShardRoutingError("Sharding currently supports SQLite shards only.")
+        with engine.begin() as conn:
+            for table in _sharded_tables():
+                table.create(conn, checkfirst=True)
+                base = shard_id_base(shard_id)
+                conn.execute(
+                    sa.text(
+                        "INSERT INTO sqlite_sequence (name, seq) SELECT :name, :seq "
+                        "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = :name)"
+                    ),
+                    {"name": table.name, "seq": base},
+                )
+                seq = conn.execute(
+                    sa.text("SELECT seq FROM sqlite_sequence WHERE name = :name"),
+                    {"name": table.name},
+                ).scalar()
+                if not base <= seq < shard_id_base(shard_id + 1):
+                    raise ShardRoutingError(
+                        f"{bind_key(shard_id)}.{table.name} ids are outside the "
+                        f"shard's range; it was created with another id layout."
+                    )
+
+
+def _move_wallets(src, dst, wallet_rows, wallets, transactions, withdrawals):
+    """Copy wallets and their ledger rows from `src` to `dst`, then delete
+    them from `src`. Rows get fresh ids in the destination shard's range.
+
+    A wallet whose user already has one on `dst` (copied by a run that died
+    before its source delete committed) has that copy replaced, so an
+    interrupted rebalance can simply be run again.
+    """
+    old_ids = [w.id for w in wallet_rows]
+    stale = dst.execute(
+        sa.select(wallets.c.id).where(wallets.c.user_id.in_([w.user_id for w in wallet_rows]))
+    ).scalars().all()
+    if stale:
+        for table in (transactions, withdrawals):
+            dst.execute(table.delete().where(table.c.wallet_id.in_(stale)))
+        dst.execute(wallets.delete().where(wallets.c.id.in_(stale)))
+
+    remap = {}
+    for w in wallet_rows:
+        new_id = dst.execute(
+            wallets.insert().values(balance=w.balance, user_id=w.user_id)
+        ).inserted_primary_key[0]
+        remap[w.id] = new_id
+
+    for table in (transactions, withdrawals):
+        rows = src.execute(sa.select(table).where(table.c.wallet_id.in_(old_ids))).mappings().all()
+        if rows:
+            dst.execute(table.insert(), [
+                {**{k: v for k, v in r.items() if k != "id"}, "wallet_id": remap[r["wallet_id"]]}
+                for r in rows
+            ])
+        src.execute(table.delete().where(table.c.wallet_id.in_(old_ids)))
+    src.execute(wallets.delete().where(wallets.c.id.in_(old_ids)))
+
+
+def rebalance(batch_size=500, echo=print):
+    """Move every wallet (with its transactions and withdrawal requests) to
+    the shard jump_hash(user_id, SHARD_COUNT) assigns it.
+
+    Sources are the default database (pre-sharding data), the configured
+    shards and any SHARD_RETIRED shards being drained after shrinking.
+    Run with the app stopped and the databases backed up; moved rows get new
+    ids. Each batch is moved one target shard at a time: the copy and the
+    source delete commit back to back, destination first. The two files
+    cannot commit atomically, so a crash in between leaves the wallet in
+    both places; rerunning rebalance replaces the destination copy and
+    finishes the move.
+    """
+    n = shard_count()
+    if not n:
+        raise ShardRoutingError("Set SENTI_SHARDS to the target shard count first.")
+
+    init_shards(n)
+    wallets, transactions, withdrawals = _sharded_tables()
+    retired = current_app.config.get("SHARD_RETIRED", 0)
+    moved = 0
+
+    for source in [None] + list(range(n + retired)):
+        src_engine = _engine(source)
+        if not sa.inspect(src_engine).has_table("wallets"):
+            continue
+        last_id = 0
+        while True:
+            with src_engine.connect() as conn:
+                batch = conn.execute(
+                    sa.select(wallets).where(wallets.c.id > last_id)
+                    .order_by(wallets.c.id).limit(batch_size)
+                ).all()
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            by_target = {}
+            for w in batch:
+                target = jump_hash(w.user_id, n)
+                if source is None or target != source:
+                    by_target.setdefault(target, []).append(w)
+            for target, rows in by_target.items():
+                # dst commits first on the way out, then src
+                with src_engine.begin() as src, _engine(target).begin() as dst:
+                    _move_wallets(src, dst, rows, wallets, transactions, withdrawals)
+                moved += len(rows)
+        echo(f"{'default' if source is None else bind_key(source)}: done, {moved} wallet(s) moved so far")
+    return moved
+
+
+# ---------------------------
+# CLI
+# ---------------------------
+@click.group("senti-shards")
+def shards_command():
+    """Manage hash-sharded wallet and ledger storage."""
+
+
+@shards_command.command("init")
+@with_appcontext
+def init_command():
+    """Create sharded tables on every configured shard."""
+    init_shards()
+    click.echo(f"Initialised {shard_count()} shard(s).")
+
+
+@shards_command.command("status")
+@with_appcontext
+def status_command():
+    """Show row counts per shard."""
+    tables = _sharded_tables()
+    retired = current_app.config.get("SHARD_RETIRED", 0)
+    for shard_id in [None] + list(range(shard_count() + retired)):
+        engine = _engine(shard_id)
+        with engine.connect() as conn:
+            if not sa.inspect(conn).has_table("wallets"):
+                continue
+            counts = ", ".join(
+                f"{t.name}={conn.execute(sa.select(sa.func.count()).select_from(t)).scalar()}"
+                for t in tables
+            )
+        click.echo(f"{'default' if shard_id is None else bind_key(shard_id)}: {counts}")
+
+
+@shards_command.command("rebalance")
+@click.option("--batch-size", default=500, show_default=True, type=click.IntRange(1))
+@with_appcontext
+def rebalance_command(batch_size):
+    """Move wallets and their ledger rows to the shard their user hashes to."""
+    try:
+        moved = rebalance(batch_size=batch_size, echo=click.echo)
+    except ShardRoutingError as e:
+        raise click.ClickException(str(e))
+    except sa.exc.SQLAlchemyError as e:
+        raise click.ClickException(
+            f"Rebalance stopped: {e}\nFix the cause and run it again; "
+            f"it picks up where it stopped."
+        )
+    click.echo(f"Rebalanced {moved} wallet(s) across {shard_count()} shard(s).")
@@ -0,0 +1,167 @@
+# bench_serving.py
+#
+# Compares how many client connections a single gunicorn worker holds at once
+# under the sync worker and the async (gevent) mode. Linux only (reads /proc).
+#
+# Each slow client connects and stays silent for --stall seconds before asking
+# for a voucher QR image, like a phone on a poor connection. Throughout the
+# stall the script samples the sockets the worker has open and reports the
+# peak ("held conns", which can include the fast client); halfway through it
+# times one request from a fast client. A sync worker takes on one slow
+# client and blocks on it, so the fast client queues behind the stall; a
+# gevent worker accepts every connection and answers the fast client at once.
+#
+# Timing starts only once the worker has served a request: gunicorn's master
+# accepts connections into the listen backlog while the worker is still
+# importing the app, which would otherwise eat into short stalls.
+#
+#   python bench_serving.py --clients 100 --stall 2
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def seed(db_uri):
+    from app import create_app
+    from app.seed import seed_database, voucher_code
+
+    app = create_app({"SQLALCHEMY_DATABASE_URI": db_uri})
+    with app.app_context():
+        seed_database(users=10, merchants=1, vouchers=10, reset=True, echo=lambda *_: None)
+    return voucher_code(1)
+
+
+def wait_for_worker(port, path, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        results = []
+        fetch(port, path, 0, results)
+        if results[0][0]:
+            return
+        time.sleep(0.1)
+    raise RuntimeError(f"gunicorn did not serve {path} on port {port}")
+
+
+def worker_pid(master_pid):
+    with open(f"/proc/{master_pid}/task/{master_pid}/children") as f:
+        return int(f.read().split()[0])
+
+
+def open_sockets(pid):
+    count = 0
+    for fd in os.listdir(f"/proc/{pid}/fd"):
+        try:
+            count += os.readlink(f"/proc/{pid}/fd/{fd}").startswith("socket:")
+        except OSError:
+            pass
+    return count
+
+
+def sample_sockets(pid, until, peak):
+    while time.perf_counter() < until:
+        peak[0] = max(peak[0], open_sockets(pid))
+        time.sleep(0.02)
+
+
+def fetch(port, path, stall, results):
+    start = time.perf_counter()
+    try:
+        with socket.create_connection(("127.0.0.1", port), timeout=120) as s:
+            time.sleep(stall)
+            s.sendall(f"GET {path} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n".encode())
+            data = b""
+            while chunk := s.recv(65536):
+                data += chunk
+        ok = data.startswith(b"HTTP/1.1 200")
+    except OSError:
+        ok = False
+    results.append((ok, time.perf_counter() - start))
+
+
+def run(worker_class, db_uri, code, clients, stall, port):
+    env = dict(
+        os.environ,
+        SENTI_DATABASE_URI=db_uri,
+        SENTI_WORKER_CLASS=worker_class,
+        WEB_CONCURRENCY="1",
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-b", f"127.0.0.1:{port}",
+         "--timeout", "300", "app:create_app()"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    path = f"/voucher/{code}/qrcode"
+    try:
+        wait_for_worker(port, path)
+        pid = worker_pid(server.pid)
+        baseline = open_sockets(pid)
+
+        results = []
+        threads = [
+            threading.Thread(target=fetch, args=(port, path, stall, results))
+            for _ in range(clients)
+        ]
+        start = time.perf_counter()
+        # Most connections the worker holds before the slow clients speak
+        peak = [baseline]
+        sampler = threading.Thread(target=sample_sockets, args=(pid, start + stall, peak))
+        sampler.start()
+        for t in threads:
+            t.start()
+
+        # Halfway through the stall: how long does a client with a fast
+        # connection have to wait?
+        time.sleep(stall / 2)
+        probe = []
+        fetch(port, path, 0, probe)
+
+        for t in threads:
+            t.join()
+        sampler.join()
+        wall = time.perf_counter() - start
+        held = peak[0] - baseline
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies = sorted(d for _, d in results)
+    return {
+        "worker": worker_class,
+        "ok": sum(ok for ok, _ in results + probe),
+        "held": held,
+        "probe": probe[0][1],
+        "wall": wall,
+        "p99": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync vs gevent worker slow-client benchmark.")
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--stall", type=float, default=2.0,
+                        help="Seconds each slow client stays silent after connecting.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", nargs="+", default=["sync", "gevent"])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_uri = "sqlite:///" + os.path.join(tmp, "bench.db")
+        code = seed(db_uri)
+
+        print(f"{args.clients} slow clients stalling {args.stall}s, 1 worker")
+        print(f"{'worker':<8} {'ok':>5} {'held conns':>11} {'fast req s':>11} {'wall s':>8} {'p99 s':>7}")
+        for worker_class in args.workers:
+            r = run(worker_class, db_uri, code, args.clients, args.stall, args.port)
+            print(f"{r['worker']:<8} {r['ok']:>5} {r['held']:>11} {r['probe']:>11.2f} "
+                  f"{r['wall']:>8.2f} {r['p99']:>7.2f}")
+
+
+if __name__ == "__main__":
+    main()
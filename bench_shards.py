@@ -0,0 +1,88 @@
+# bench_shards.py
+#
+# Measures deposit write throughput (wallet balance update + ledger insert,
+# one commit each, as in /wallet/deposit) against 1..N wallet shards.
+#
+# Each run seeds a fresh set of databases, then --procs processes deposit
+# into random users' wallets for --seconds through the app's own session and
+# shard router. With one shard every commit queues on the same SQLite writer
+# lock; with N shards up to N commits proceed at once.
+#
+#   python bench_shards.py --shards 1 2 4 8 --procs 8
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from multiprocessing import Pool
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+
+
+def make_app(workdir, shards):
+    from app import create_app
+
+    return create_app({
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///" + os.path.join(workdir, "senti.db"),
+        "SHARD_COUNT": shards,
+        "SHARD_DATABASE_URI": "sqlite:///" + os.path.join(workdir, "shard_{}.db"),
+        "RATELIMIT_DATABASE": os.path.join(workdir, "ratelimit.db"),
+    })
+
+
+def deposit_loop(args):
+    workdir, shards, users, seconds, seed = args
+    from app import db
+    from app.models import Wallet, Transaction
+
+    app = make_app(workdir, shards)
+    rng = random.Random(seed)
+    done = 0
+    with app.app_context():
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            # Same statements as routes.wallet_deposit
+            wallet = Wallet.query.filter_by(user_id=rng.randint(2, users + 1)).first()
+            wallet.balance += 10.0
+            db.session.commit()
+            db.session.add(Transaction(wallet_id=wallet.id, type="credit", amount=10.0,
+                                       description="Deposit simulation of R10.00"))
+            db.session.commit()
+            done += 1
+    return done
+
+
+def run(shards, procs, users, seconds):
+    from app.seed import seed_database
+
+    with tempfile.TemporaryDirectory() as workdir:
+        app = make_app(workdir, shards)
+        with app.app_context():
+            seed_database(users=users, reset=True, echo=lambda *_: None)
+
+        with Pool(procs) as pool:
+            tasks = [(workdir, shards, users, seconds, i) for i in range(procs)]
+            return sum(pool.map(deposit_loop, tasks)) / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deposit throughput vs. shard count.")
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--procs", type=int, default=8)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args()
+
+    print(f"{args.procs} writer processes, {args.users} wallets, {args.seconds}s per run")
+    print(f"{'shards':>6} {'deposits/s':>11} {'speedup':>8}")
+    base = None
+    for shards in args.shards:
+        rate = run(shards, args.procs, args.users, args.seconds)
+        base = base or rate
+        print(f"{shards:>6} {rate:>11.0f} {rate / base:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
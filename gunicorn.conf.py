@@ -0,0 +1,24 @@
+# gunicorn.conf.py
+#
+# Picked up automatically by `gunicorn "app:create_app()"` (see Procfile).
+#
+#   SENTI_WORKER_CLASS=sync    one request per worker at a time (default)
+#   SENTI_WORKER_CLASS=gevent  async mode: each worker holds up to
+#                              SENTI_WORKER_CONNECTIONS open connections and
+#                              renders QR codes on SENTI_QR_THREADS threads.
+#                              SQLite calls still block the worker's event
+#                              loop (see app/serving.py), so size
+#                              WEB_CONCURRENCY as for sync workers.
+import os
+
+worker_class = os.environ.get("SENTI_WORKER_CLASS", "sync")
+workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+worker_connections = int(os.environ.get("SENTI_WORKER_CONNECTIONS", 1000))
+qr_threads = int(os.environ.get("SENTI_QR_THREADS", 4))
+
+
+def post_worker_init(worker):
+    if worker_class == "gevent":
+        # Native threads available to QR rendering (see app/serving.py)
+        from gevent import get_hub
+        get_hub().threadpool.maxsize = qr_threads
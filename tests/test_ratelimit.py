@@ -0,0 +1,155 @@
+# tests/test_ratelimit.py
+#
+# Token-bucket rate limiter (app/ratelimit.py) and its configuration.
+#
+#   python -m pytest -q tests
+
+import pytest
+import sqlalchemy as sa
+from flask import Flask
+
+from app import create_app, db
+from app.ratelimit import RateLimiter
+from app.seed import seed_database
+
+
+def make_app(tmp_path, **config):
+    return create_app({
+        "TESTING": True,
+        "WTF_CSRF_ENABLED": False,
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path}/senti.db",
+        "RATELIMIT_DATABASE": str(tmp_path / "ratelimit.db"),
+        "SHARD_COUNT": 0,
+        **config,
+    })
+
+
+@pytest.fixture
+def limiter(tmp_path):
+    app = Flask(__name__)
+    app.config["RATELIMIT_DATABASE"] = str(tmp_path / "ratelimit.db")
+    limiter = RateLimiter(app)
+    with app.app_context():
+        yield limiter
+
+
+def bucket(limiter, key):
+    return next(b for b in limiter.top_keys(limit=100) if b["key"] == key)
+
+
+# ---------------------------
+# BUCKETS
+# ---------------------------
+def test_burst_then_refill(limiter):
+    limits = [("k", 3, 60)]  # one token per second
+    assert [limiter.hit(limits, now=1000) for _ in range(3)] == [0, 0, 0]
+    assert limiter.hit(limits, now=1000) == pytest.approx(1.0)
+    assert limiter.hit(limits, now=1000.5) == pytest.approx(0.5)
+    assert limiter.hit(limits, now=1001) == 0
+    # Refill stops at the burst size
+    assert [limiter.hit(limits, now=2000) for _ in range(4)][-1] == pytest.approx(1.0)
+
+
+def test_empty_user_bucket_does_not_drain_ip(limiter):
+    limits = [("ip", 5, 60), ("user", 1, 60)]
+    assert limiter.hit(limits, now=1000) == 0
+    for _ in range(3):
+        assert limiter.hit(limits, now=1000) > 0
+
+    ip, user = bucket(limiter, "ip"), bucket(limiter, "user")
+    assert ip["tokens"] == pytest.approx(4)
+    assert (ip["allowed"], ip["limited"]) == (1, 0)
+    assert (user["allowed"], user["limited"]) == (1, 3)
+
+
+def test_every_empty_bucket_counts_the_rejection(limiter):
+    limits = [("ip", 1, 60), ("user", 1, 60)]
+    limiter.hit(limits, now=1000)
+    limiter.hit(limits, now=1000)
+    assert bucket(limiter, "ip")["limited"] == 1
+    assert bucket(limiter, "user")["limited"] == 1
+
+
+@pytest.mark.parametrize("setting", [
+    {"RATELIMIT_USER_PER_MINUTE": 0},
+    {"RATELIMIT_IP_PER_MINUTE": -1},
+    {"RATELIMIT_USER_BURST": 0},
+    {"RATELIMIT_IP_BURST": 0.5},
+])
+def test_init_app_rejects_unusable_rates(tmp_path, setting):
+    with pytest.raises(ValueError):
+        make_app(tmp_path, **setting)
+
+
+# ---------------------------
+# VIEW DECORATOR
+# ---------------------------
+@pytest.mark.parametrize("proxies, forwarded, expected", [
+    (0, None, "10.0.0.1"),
+    (0, "1.2.3.4", "10.0.0.1"),
+    (1, None, "10.0.0.1"),
+    (1, "1.2.3.4", "1.2.3.4"),
+    # A client-supplied entry left of the proxy's is ignored
+    (1, "6.6.6.6, 1.2.3.4", "1.2.3.4"),
+    (2, "6.6.6.6, 1.2.3.4, 10.1.1.1", "1.2.3.4"),
+])
+def test_client_ip(proxies, forwarded, expected):
+    app = Flask(__name__)
+    app.config["RATELIMIT_PROXY_COUNT"] = proxies
+    headers = {"X-Forwarded-For": forwarded} if forwarded else {}
+    with app.test_request_context(headers=headers, environ_base={"REMOTE_ADDR": "10.0.0.1"}):
+        assert RateLimiter.client_ip() == expected
+
+
+def test_limited_request_gets_429_without_touching_the_database(tmp_path):
+    app = make_app(tmp_path, RATELIMIT_USER_BURST=2, RATELIMIT_USER_PER_MINUTE=10)
+    with app.app_context():
+        seed_database(reset=True, echo=lambda *_: None)
+    client = app.test_client()
+    client.post("/register", data={"email": "u@example.com", "password": "secret1",
+                                   "confirm": "secret1"})
+    client.post("/login", data={"email": "u@example.com", "password": "secret1"})
+
+    assert client.get("/redeem/NOSUCHCODE").status_code == 302
+    assert client.get("/redeem/NOSUCHCODE").status_code == 302
+
+    queries = []
+    with app.app_context():
+        engine = db.engine
+    sa.event.listen(engine, "before_cursor_execute", lambda *args: queries.append(args[2]))
+    response = client.get("/redeem/NOSUCHCODE")
+    assert response.status_code == 429
+    assert 1 <= int(response.headers["Retry-After"]) <= 7
+    assert queries == []
+
+    # The voucher form only counts POSTs
+    assert client.get("/wallet").status_code == 200
+
+
+# ---------------------------
+# CONFIG
+# ---------------------------
+def test_limits_come_from_the_environment(tmp_path, monkeypatch):
+    monkeypatch.setenv("SENTI_RATELIMIT_USER_BURST", "3")
+    monkeypatch.setenv("SENTI_RATELIMIT_USER_PER_MINUTE", "1.5")
+    monkeypatch.setenv("SENTI_RATELIMIT_IP_BURST", "50")
+    monkeypatch.setenv("SENTI_RATELIMIT_IP_PER_MINUTE", "120")
+    monkeypatch.setenv("SENTI_RATELIMIT_PROXY_COUNT", "2")
+    monkeypatch.setenv("SENTI_RATELIMIT_ENABLED", "0")
+    config = make_app(tmp_path).config
+    assert config["RATELIMIT_USER_BURST"] == 3
+    assert config["RATELIMIT_USER_PER_MINUTE"] == 1.5
+    assert config["RATELIMIT_IP_BURST"] == 50
+    assert config["RATELIMIT_IP_PER_MINUTE"] == 120
+    assert config["RATELIMIT_PROXY_COUNT"] == 2
+    assert config["RATELIMIT_ENABLED"] is False
+
+
+@pytest.mark.parametrize("dyno, proxies", [(None, 0), ("web.1", 1)])
+def test_proxy_count_defaults_to_the_platform(tmp_path, monkeypatch, dyno, proxies):
+    monkeypatch.delenv("SENTI_RATELIMIT_PROXY_COUNT", raising=False)
+    if dyno:
+        monkeypatch.setenv("DYNO", dyno)
+    else:
+        monkeypatch.delenv("DYNO", raising=False)
+    assert make_app(tmp_path).config["RATELIMIT_PROXY_COUNT"] == proxies
@@ -0,0 +1,78 @@
+# tests/test_seed.py
+#
+# `flask senti-seed` data must be a ledger the app could have produced.
+#
+#   python -m pytest -q tests
+
+import pytest
+import sqlalchemy as sa
+
+from app import create_app
+from app.seed import seed_database
+from app.sharding import _engine, shard_ids
+
+
+def ledger_query(conn, sql):
+    return conn.execute(sa.text(sql)).scalar()
+
+
+@pytest.mark.parametrize("shards", [0, 3])
+def test_seeded_ledger_is_consistent(tmp_path, shards):
+    app = create_app({
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path}/senti.db",
+        "RATELIMIT_DATABASE": str(tmp_path / "ratelimit.db"),
+        "SHARD_COUNT": shards,
+        "SHARD_DATABASE_URI": f"sqlite:///{tmp_path}/shard_{{}}.db",
+    })
+    with app.app_context():
+        counts = seed_database(users=300, merchants=5, vouchers=2000, redeemed_fraction=0.4,
+                               transactions=3000, withdrawals=800, batch_size=700,
+                               reset=True, seed=7, echo=lambda *_: None)
+
+        with _engine(None).connect() as conn:
+            redeemed = sorted(conn.execute(sa.text(
+                "SELECT code, redeemer_id, amount FROM vouchers WHERE is_redeemed = 1"
+            )).all())
+            assert ledger_query(conn, "SELECT count(*) FROM vouchers "
+                                      "WHERE is_redeemed = 0 AND redeemer_id IS NOT NULL") == 0
+
+        credits = []
+        for shard in shard_ids():
+            with _engine(shard).connect() as conn:
+                # Balances are what the ledger adds up to
+                assert ledger_query(conn, """
+                    SELECT count(*) FROM wallets w WHERE abs(w.balance - (
+                        SELECT coalesce(sum(CASE t.type WHEN 'credit' THEN t.amount
+                                                        ELSE -t.amount END), 0)
+                        FROM transactions t WHERE t.wallet_id = w.id)) > 0.005
+                """) == 0
+                # Every debit is an approved withdrawal, and every approved
+                # withdrawal has its debit
+                assert ledger_query(conn, """
+                    SELECT count(*) FROM wallets w WHERE
+                        (SELECT count(*) FROM transactions t
+                         WHERE t.wallet_id = w.id AND t.type = 'debit')
+                        != (SELECT count(*) FROM withdrawal_requests r
+                            WHERE r.wallet_id = w.id AND r.status = 'approved')
+                        OR abs((SELECT coalesce(sum(t.amount), 0) FROM transactions t
+                                WHERE t.wallet_id = w.id AND t.type = 'debit')
+                               - (SELECT coalesce(sum(r.amount), 0) FROM withdrawal_requests r
+                                  WHERE r.wallet_id = w.id AND r.status = 'approved')) > 0.005
+                """) == 0
+                # Pending withdrawals can all still be approved
+                assert ledger_query(conn, """
+                    SELECT count(*) FROM wallets w WHERE w.balance + 0.005 < (
+                        SELECT coalesce(sum(r.amount), 0) FROM withdrawal_requests r
+                        WHERE r.wallet_id = w.id AND r.status = 'pending')
+                """) == 0
+                assert ledger_query(conn, "SELECT count(*) FROM wallets WHERE balance < 0") == 0
+                credits += conn.execute(sa.text("""
+                    SELECT substr(t.description, length('Voucher redeemed: ') + 1), w.user_id, t.amount
+                    FROM transactions t JOIN wallets w ON w.id = t.wallet_id
+                    WHERE t.description LIKE 'Voucher redeemed: %'
+                """)).all()
+
+    # One credit per redeemed voucher, on the redeemer's wallet
+    assert redeemed
+    assert sorted(credits) == redeemed
+    assert counts["vouchers"] == 2000
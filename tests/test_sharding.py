@@ -0,0 +1,321 @@
+# tests/test_sharding.py
+#
+# Shard router, cross-database redemption and rebalancing, against throwaway
+# SQLite files.
+#
+#   python -m pytest -q tests
+
+import pytest
+import sqlalchemy as sa
+
+from app import create_app, db
+from app.models import User, Wallet, Voucher, Transaction, WithdrawalRequest
+from app.seed import ADMIN_EMAIL, ADMIN_PASSWORD, seed_database
+from app.sharding import (
+    SHARD_ID_BITS, ShardRoutingError, _engine, gather, jump_hash, shard_for_id,
+    shard_for_user
+)
+
+
+def make_app(tmp_path, shards, retired=0):
+    return create_app({
+        "TESTING": True,
+        "WTF_CSRF_ENABLED": False,
+        "RATELIMIT_ENABLED": False,
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path}/senti.db",
+        "RATELIMIT_DATABASE": str(tmp_path / "ratelimit.db"),
+        "SHARD_COUNT": shards,
+        "SHARD_RETIRED": retired,
+        "SHARD_DATABASE_URI": f"sqlite:///{tmp_path}/shard_{{}}.db",
+    })
+
+
+def seed(app):
+    with app.app_context():
+        seed_database(users=40, merchants=2, vouchers=30, transactions=200,
+                      withdrawals=20, reset=True, seed=1, echo=lambda *_: None)
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = make_app(tmp_path, shards=2)
+    seed(app)
+    return app
+
+
+def login(client, email, password):
+    return client.post("/login", data={"email": email, "password": password})
+
+
+def register(app, client, email="user@example.com", password="secret1"):
+    client.post("/register", data={"email": email, "password": password, "confirm": password})
+    login(client, email, password)
+    with app.app_context():
+        return User.query.filter_by(email=email).one().id
+
+
+def unredeemed_vouchers(app, count):
+    with app.app_context():
+        return [(v.id, v.code, v.amount)
+                for v in Voucher.query.filter_by(is_redeemed=False).limit(count)]
+
+
+def balance(app, user_id):
+    with app.app_context():
+        return Wallet.query.filter_by(user_id=user_id).one().balance
+
+
+def totals():
+    return (
+        round(sum(b or 0 for b in gather(db.select(db.func.sum(Wallet.balance)), scalars=True)), 2),
+        sum(gather(db.select(db.func.count(Transaction.id)), scalars=True)),
+        sum(gather(db.select(db.func.count(WithdrawalRequest.id)), scalars=True)),
+    )
+
+
+# ---------------------------
+# ROUTER
+# ---------------------------
+def test_flush_routes_rows_to_the_users_shard(app):
+    with app.app_context():
+        for i in range(6):
+            user = User(email=f"u{i}@example.com", password_hash="x")
+            db.session.add(user)
+            db.session.commit()
+            wallet = Wallet(user_id=user.id, balance=5.0)
+            db.session.add(wallet)
+            db.session.commit()
+            txn = Transaction(wallet_id=wallet.id, type="credit", amount=5.0)
+            wr = WithdrawalRequest(wallet_id=wallet.id, amount=1.0, status="pending")
+            db.session.add_all([txn, wr])
+            db.session.commit()
+
+            shard = shard_for_user(user.id)
+            assert shard_for_id(wallet.id) == shard
+            assert shard_for_id(txn.id) == shard
+            assert shard_for_id(wr.id) == shard
+            with _engine(shard).connect() as conn:
+                assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+                assert conn.execute(sa.text("SELECT user_id FROM wallets WHERE id = :id"),
+                                    {"id": wallet.id}).scalar() == user.id
+            with _engine(1 - shard).connect() as conn:
+                assert conn.execute(sa.text("SELECT count(*) FROM transactions WHERE id = :id"),
+                                    {"id": txn.id}).scalar() == 0
+
+
+def test_get_and_lazy_loads_find_the_shard(app):
+    with app.app_context():
+        user_ids = [u.id for u in User.query.filter(User.role != "admin")]
+        assert {shard_for_user(i) for i in user_ids} == {0, 1}
+        for user_id in user_ids:
+            user = db.session.get(User, user_id)
+            wallet = user.wallet
+            assert wallet.user_id == user.id
+            for txn in wallet.transactions:
+                assert txn.wallet_id == wallet.id
+            db.session.expunge_all()
+            assert db.session.get(Wallet, wallet.id).user_id == user_id
+
+
+def test_unkeyed_queries_raise(app):
+    with app.app_context():
+        with pytest.raises(ShardRoutingError):
+            Wallet.query.all()
+        with pytest.raises(ShardRoutingError):
+            Wallet.query.filter(Wallet.id.in_([1, 1 << SHARD_ID_BITS])).all()
+
+
+def test_only_top_level_and_keys_route(app):
+    with app.app_context():
+        user_id = User.query.filter(User.role != "admin").first().id
+        other = next(u.id for u in User.query if shard_for_user(u.id) != shard_for_user(user_id))
+        wallet = Wallet.query.filter_by(user_id=user_id).one()
+        other_wallet = Wallet.query.filter_by(user_id=other).one()
+
+        with pytest.raises(ShardRoutingError):
+            Wallet.query.filter(sa.or_(Wallet.user_id == user_id, Wallet.balance > 100)).count()
+        with pytest.raises(ShardRoutingError):
+            Wallet.query.filter(sa.not_(Wallet.user_id == user_id)).all()
+        with pytest.raises(ShardRoutingError):
+            Wallet.query.filter(Wallet.user_id == user_id, Wallet.id == other_wallet.id).all()
+
+        assert Wallet.query.filter(
+            sa.and_(Wallet.balance >= 0, sa.and_(Wallet.user_id == user_id))
+        ).one().id == wallet.id
+        assert Wallet.query.filter_by(user_id=user_id).count() == 1
+        assert Transaction.query.filter(
+            Transaction.wallet_id == wallet.id,
+            sa.or_(Transaction.type == "credit", Transaction.type == "debit"),
+        ).count() == len(wallet.transactions)
+
+
+def test_unconfigured_shard_id_is_not_found(app):
+    missing = 5 << SHARD_ID_BITS
+    with app.app_context():
+        assert db.session.get(WithdrawalRequest, missing) is None
+        assert Transaction.query.filter_by(wallet_id=missing).all() == []
+
+    client = app.test_client()
+    login(client, ADMIN_EMAIL, ADMIN_PASSWORD)
+    assert client.get(f"/admin/withdrawals/approve/{missing}").status_code == 404
+
+
+# ---------------------------
+# ROUTES
+# ---------------------------
+def test_wallet_flows(app):
+    # Requests run outside app.app_context(): Flask would otherwise reuse the
+    # test's context (and Flask-Login's cached user) for every request.
+    client = app.test_client()
+    user_id = register(app, client)
+    with app.app_context():
+        before = totals()[0]
+    (v_id, v_code, v_amount), (_, qr_code, qr_amount) = unredeemed_vouchers(app, 2)
+
+    client.post("/wallet/deposit", data={"amount": "100"})
+    client.post("/wallet", data={"code": v_code})
+    client.get(f"/redeem/{qr_code}")
+    client.post("/wallet/withdraw", data={"amount": "30"})
+    assert client.get("/wallet/history").status_code == 200
+
+    credited = 100 + v_amount + qr_amount
+    with app.app_context():
+        wallet = Wallet.query.filter_by(user_id=user_id).one()
+        assert wallet.balance == pytest.approx(credited)
+        assert sorted(t.amount for t in wallet.transactions) == sorted([100.0, v_amount, qr_amount])
+        assert db.session.get(Voucher, v_id).redeemer_id == user_id
+        assert totals()[0] == pytest.approx(before + credited)
+        wr_id = WithdrawalRequest.query.filter_by(wallet_id=wallet.id).one().id
+        total = totals()[0]
+
+    admin = app.test_client()
+    login(admin, ADMIN_EMAIL, ADMIN_PASSWORD)
+    page = admin.get("/admin")
+    assert page.status_code == 200
+    assert f"{total:.2f}".encode() in page.data
+    admin.get(f"/admin/withdrawals/approve/{wr_id}")
+
+    with app.app_context():
+        assert db.session.get(WithdrawalRequest, wr_id).status == "approved"
+    assert balance(app, user_id) == pytest.approx(credited - 30)
+
+
+def test_voucher_is_credited_once(app):
+    client = app.test_client()
+    user_id = register(app, client)
+    [(_, code, amount)] = unredeemed_vouchers(app, 1)
+    client.post("/wallet", data={"code": code})
+    client.get(f"/redeem/{code}")
+    assert balance(app, user_id) == pytest.approx(amount)
+
+
+def test_failed_credit_releases_the_claim(app):
+    client = app.test_client()
+    user_id = register(app, client)
+    with app.app_context(), _engine(shard_for_user(user_id)).begin() as conn:
+        conn.execute(sa.text("ALTER TABLE transactions RENAME TO transactions_off"))
+
+    [(v_id, code, _)] = unredeemed_vouchers(app, 1)
+    page = client.post("/wallet", data={"code": code}, follow_redirects=True)
+    assert b"Could not redeem" in page.data
+
+    with app.app_context():
+        v = db.session.get(Voucher, v_id)
+        assert not v.is_redeemed and v.redeemer_id is None
+    assert balance(app, user_id) == 0
+
+
+# ---------------------------
+# REBALANCING
+# ---------------------------
+def assert_rebalanced(n, expected, drained):
+    assert totals() == (pytest.approx(expected[0]), expected[1], expected[2])
+    for source in drained:
+        with _engine(source).connect() as conn:
+            assert conn.execute(sa.text("SELECT count(*) FROM wallets")).scalar() == 0
+    for shard in range(n):
+        with _engine(shard).connect() as conn:
+            for user_id, wallet_id in conn.execute(sa.text("SELECT user_id, id FROM wallets")):
+                assert jump_hash(user_id, n) == shard == shard_for_id(wallet_id)
+            for table in ("transactions", "withdrawal_requests"):
+                assert conn.execute(sa.text(
+                    f"SELECT count(*) FROM {table} WHERE wallet_id NOT IN "
+                    "(SELECT id FROM wallets)"
+                )).scalar() == 0
+
+
+def rebalance(app):
+    return app.test_cli_runner().invoke(args=["senti-shards", "rebalance", "--batch-size", "7"])
+
+
+@pytest.mark.parametrize("steps", [[3, 4, 2]])
+def test_rebalance_keeps_totals(tmp_path, steps):
+    app = make_app(tmp_path, shards=0)
+    seed(app)
+    with app.app_context():
+        expected = totals()
+
+    previous = 0
+    for n in steps:
+        app = make_app(tmp_path, shards=n, retired=max(0, previous - n))
+        result = rebalance(app)
+        assert result.exit_code == 0, result.output
+        with app.app_context():
+            assert_rebalanced(n, expected, [None] + list(range(n, previous)))
+        previous = n
+
+
+def test_legacy_ids_do_not_reach_moved_rows(tmp_path):
+    app = make_app(tmp_path, shards=0)
+    seed(app)
+    with app.app_context():
+        legacy = [w.id for w in WithdrawalRequest.query.filter_by(status="pending")]
+
+    app = make_app(tmp_path, shards=3)
+    assert rebalance(app).exit_code == 0
+    with app.app_context():
+        for shard in range(3):
+            with _engine(shard).connect() as conn:
+                for table in ("wallets", "transactions", "withdrawal_requests"):
+                    assert conn.execute(sa.text(f"SELECT min(id) FROM {table}")).scalar() > 1 << SHARD_ID_BITS
+
+    admin = app.test_client()
+    login(admin, ADMIN_EMAIL, ADMIN_PASSWORD)
+    for wr_id in legacy:
+        assert admin.get(f"/admin/withdrawals/approve/{wr_id}").status_code == 404
+
+
+def test_interrupted_rebalance_can_be_rerun(tmp_path):
+    app = make_app(tmp_path, shards=0)
+    seed(app)
+    with app.app_context():
+        expected = totals()
+
+    # Kill the run between a destination commit and its source delete
+    app = make_app(tmp_path, shards=3)
+    commits = []
+
+    def fail_second_source_commit(conn):
+        commits.append(conn)
+        if len(commits) == 2:
+            raise sa.exc.OperationalError("COMMIT", {}, Exception("killed"))
+
+    with app.app_context():
+        sa.event.listen(_engine(None), "commit", fail_second_source_commit)
+    result = rebalance(app)
+    assert result.exit_code != 0
+    assert "run it again" in result.output
+    with app.app_context():
+        sa.event.remove(_engine(None), "commit", fail_second_source_commit)
+        with _engine(None).connect() as conn:
+            left = set(conn.execute(sa.text("SELECT user_id FROM wallets")).scalars())
+        copied = set()
+        for shard in range(3):
+            with _engine(shard).connect() as conn:
+                copied.update(conn.execute(sa.text("SELECT user_id FROM wallets")).scalars())
+        assert left & copied
+
+    result = rebalance(app)
+    assert result.exit_code == 0, result.output
+    with app.app_context():
+        assert_rebalanced(3, expected, [None])